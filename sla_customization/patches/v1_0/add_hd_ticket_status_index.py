@@ -0,0 +1,11 @@
+import frappe
+
+
+def execute():
+	"""
+	Covering index for the SLA engine's `status IN (...)` scans on HD Ticket.
+	"""
+	if not frappe.db.table_exists("HD Ticket"):
+		return
+
+	frappe.db.add_index("HD Ticket", ["status", "name"], index_name="idx_status_name")
@@ -0,0 +1,60 @@
+import frappe
+
+NOTIFIED_FIELDS = (
+	"fr_50_notified",
+	"fr_75_notified",
+	"fr_100_notified",
+	"res_50_notified",
+	"res_75_notified",
+	"res_100_notified",
+)
+TIMESTAMP_FIELDS = ("first_responded_on", "resolution_date")
+
+
+def execute():
+	"""
+	Keep only the newest Sla Update per ticket so `ticket_id` can become unique.
+
+	The engine used to write to the newest duplicate, but progress may be spread
+	across rows, so flags and timestamps of all duplicates are merged first.
+	"""
+	if not frappe.db.table_exists("Sla Update"):
+		return
+
+	remove_duplicates("tabSla Update")
+
+
+def remove_duplicates(table):
+	"""
+	Merge duplicate rows per `ticket_id` of `table` into the newest one (by
+	creation, then name) and delete the rest. Rows without a ticket_id are kept.
+	"""
+	merged = ", ".join(
+		[f"MAX(`{field}`) AS `{field}`" for field in NOTIFIED_FIELDS + TIMESTAMP_FIELDS]
+	)
+	assignments = ", ".join(
+		[f"s.`{field}` = merged.`{field}`" for field in NOTIFIED_FIELDS]
+		+ [f"s.`{field}` = COALESCE(s.`{field}`, merged.`{field}`)" for field in TIMESTAMP_FIELDS]
+	)
+
+	frappe.db.sql(
+		f"""
+		UPDATE `{table}` s
+		JOIN (
+			SELECT ticket_id, {merged}
+			FROM `{table}`
+			GROUP BY ticket_id
+			HAVING COUNT(*) > 1
+		) merged ON merged.ticket_id = s.ticket_id
+		SET {assignments}
+		"""
+	)
+
+	frappe.db.sql(
+		f"""
+		DELETE s FROM `{table}` s
+		JOIN `{table}` keep
+			ON keep.ticket_id = s.ticket_id
+			AND (keep.creation, keep.name) > (s.creation, s.name)
+		"""
+	)
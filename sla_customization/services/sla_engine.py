@@ -1,5 +1,7 @@
+from datetime import timedelta
+
 import frappe
-from frappe.utils import now_datetime, get_datetime, add_days
+from frappe.utils import cstr, now_datetime
 
 
 # =========================================================
@@ -9,86 +11,313 @@ from frappe.utils import now_datetime, get_datetime, add_days
 def run():
     """
     Scheduler entry point.
+
+    Tickets are processed in bounded chunks; the writes of each chunk are
+    staged and committed in one transaction.
     """
+    try:
+        now = now_datetime()
+
+        # Each ticket in a chunk is dispatched by status
+        for tickets in iter_ticket_chunks(now):
+            process_ticket_batch(tickets, now)
+            frappe.db.commit()
+
+        close_resolved_tickets(now)
+
+        frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        raise
 
-    # ------------------------------------------------------------------
-    # 1. STATE TRACKING (timestamps must see all relevant statuses)
-    # ------------------------------------------------------------------
-    state_tickets = get_tickets_by_status(
-        ["Open", "In-Progress", "Resolved", "Closed"]
-    )
 
-    for ticket in state_tickets:
-        sla_update = get_or_create_sla_update(ticket.name)
-        record_first_response_time(ticket, sla_update)
-        record_resolution_time(ticket, sla_update)
+def process_ticket_batch(tickets, now):
+    """
+    Preload, evaluate and flush one batch of ticket rows.
+    Tickets and Sla Updates are plain rows (frappe._dict), never Documents;
+    tickets are independent of each other and the caller commits.
+    """
+    dirty = {}
+    pending_flags = {}
+
+    cache = preload_sla_updates([cstr(t.name) for t in tickets], now)
+    assignee_emails = preload_assignee_emails([
+        cstr(t.name) for t in tickets
+        if t.status in ACTIVE_STATUSES
+    ])
+
+    for ticket in tickets:
+        process_ticket(
+            ticket,
+            cache[cstr(ticket.name)],
+            assignee_emails,
+            dirty,
+            pending_flags,
+            now
+        )
+
+    flush_sla_updates(dirty)
+    flush_notified_flags(pending_flags)
 
-    # ------------------------------------------------------------------
-    # 2. FIRST RESPONSE SLA → ONLY Open tickets
-    # ------------------------------------------------------------------
-    open_tickets = get_tickets_by_status(["Open"])
-    for ticket in open_tickets:
-        sla_update = get_or_create_sla_update(ticket.name)
-        handle_first_response(ticket, sla_update)
 
-    # ------------------------------------------------------------------
-    # 3. RESOLUTION SLA → Open + In-Progress tickets
-    # ------------------------------------------------------------------
-    resolution_tickets = get_tickets_by_status(["Open", "In-Progress"])
-    for ticket in resolution_tickets:
-        sla_update = get_or_create_sla_update(ticket.name)
-        handle_resolution(ticket, sla_update)
+def process_ticket(ticket, sla_update, assignee_emails, dirty, pending_flags, now):
+    """
+    State recording and milestone checks for a single ticket.
+    """
+    # STATE TRACKING (timestamps must see all relevant statuses)
+    record_first_response_time(ticket, sla_update, dirty, now)
+    record_resolution_time(ticket, sla_update, dirty)
+
+    # FIRST RESPONSE SLA → ONLY Open tickets
+    if ticket.status == "Open":
+        handle_first_response(
+            ticket, sla_update, pending_flags, assignee_emails
+        )
 
-    close_resolved_tickets()
+    # RESOLUTION SLA → Open + In-Progress tickets
+    if ticket.status in ACTIVE_STATUSES:
+        handle_resolution(
+            ticket, sla_update, pending_flags, assignee_emails
+        )
 
 
 # =========================================================
-# FETCH TICKETS BY STATUS
+# FETCH TICKETS TO PROCESS
 # =========================================================
 
-def get_tickets_by_status(status_list):
+ACTIVE_STATUSES = ("Open", "In-Progress")
+DONE_STATUSES = ("Resolved", "Closed")
+CHUNK_SIZE = 500
+
+
+def iter_ticket_chunks(now, chunk_size=CHUNK_SIZE):
     """
-    Fetch HD Ticket docs by status list.
+    Yield lists of ticket rows to process, paginated by ticket name so
+    memory stays bounded by `chunk_size`.
     """
-    names = frappe.get_all(
-        "HD Ticket",
-        filters={"status": ["in", status_list]},
-        pluck="name"
+    last_name = None
+    while True:
+        tickets = get_tickets_to_process(now, last_name, chunk_size)
+        if not tickets:
+            return
+
+        yield tickets
+
+        if len(tickets) < chunk_size:
+            return
+        last_name = tickets[-1].name
+
+
+def get_tickets_to_process(now, after=None, limit=CHUNK_SIZE):
+    """
+    Fetch HD Ticket rows the engine still has work for: every active ticket,
+    plus Resolved/Closed tickets whose resolution date is not yet recorded
+    on their Sla Update (nothing else is tracked once a ticket is done).
+
+    Elapsed First Response / Resolution SLA percentages are computed by the
+    database as `fr_pct` / `res_pct` (0 when no due date, 100 when the due
+    date is not after creation, otherwise capped at 100).
+
+    Rows come back ordered by name, starting after `after` (if given).
+    """
+    return frappe.db.sql(
+        """
+        SELECT
+            t.name, t.status, t.creation, t.first_response_time,
+            t.resolution_time, t.resolution_date,
+            CASE
+                WHEN t.response_by IS NULL THEN 0
+                WHEN TIMESTAMPDIFF(SECOND, t.creation, t.response_by) <= 0 THEN 100
+                ELSE LEAST(100,
+                    TIMESTAMPDIFF(SECOND, t.creation, %(now)s) * 100
+                    / TIMESTAMPDIFF(SECOND, t.creation, t.response_by))
+            END AS fr_pct,
+            CASE
+                WHEN t.resolution_by IS NULL THEN 0
+                WHEN TIMESTAMPDIFF(SECOND, t.creation, t.resolution_by) <= 0 THEN 100
+                ELSE LEAST(100,
+                    TIMESTAMPDIFF(SECOND, t.creation, %(now)s) * 100
+                    / TIMESTAMPDIFF(SECOND, t.creation, t.resolution_by))
+            END AS res_pct
+        FROM `tabHD Ticket` t
+        LEFT JOIN `tabSla Update` s ON s.ticket_id = CAST(t.name AS CHAR)
+        WHERE (%(after)s IS NULL OR t.name > %(after)s)
+            AND (
+                t.status IN %(active)s
+                OR (
+                    t.status IN %(done)s
+                    AND (
+                        s.name IS NULL
+                        OR (s.resolution_date IS NULL AND t.resolution_date IS NOT NULL)
+                    )
+                )
+            )
+        ORDER BY t.name
+        LIMIT %(limit)s
+        """,
+        {
+            "active": ACTIVE_STATUSES,
+            "done": DONE_STATUSES,
+            "now": now,
+            "after": after,
+            "limit": limit
+        },
+        as_dict=True
     )
-    return [frappe.get_doc("HD Ticket", name) for name in names]
 
 
 # =========================================================
-# SLA UPDATE DOC (CUSTOM DOCTYPE)
+# SLA UPDATE ROWS (CUSTOM DOCTYPE)
 # =========================================================
 
-def get_or_create_sla_update(ticket_name):
+MILESTONES = (50, 75, 100)
+
+# Milestone -> notified flag fieldname
+FR_FIELDS = {m: f"fr_{m}_notified" for m in MILESTONES}
+RES_FIELDS = {m: f"res_{m}_notified" for m in MILESTONES}
+
+NOTIFIED_FIELDS = [*FR_FIELDS.values(), *RES_FIELDS.values()]
+
+SLA_UPDATE_FIELDS = [
+    "name",
+    "ticket_id",
+    "first_responded_on",
+    "resolution_date",
+    *NOTIFIED_FIELDS,
+]
+
+
+UPSERT_ATTEMPTS = 3
+
+
+def preload_sla_updates(ticket_names, now):
     """
-    Fetch existing Sla Update doc or create one.
+    Load Sla Update rows for all tickets in one query, keyed by ticket_id.
+    Missing rows are created with a single bulk upsert.
+
+    `ticket_id` is a varchar Link while HD Ticket names are autoincrement
+    integers, so callers pass and look up names as strings (cstr).
     """
-    existing = frappe.get_all(
+    if not ticket_names:
+        return {}
+
+    cache = fetch_sla_updates(ticket_names)
+
+    # A generated name colliding with an existing row leaves that ticket
+    # without a row; retry it with a fresh name
+    for _attempt in range(UPSERT_ATTEMPTS):
+        missing = [name for name in ticket_names if name not in cache]
+        if not missing:
+            break
+
+        upsert_sla_updates(missing, now)
+        cache.update(fetch_sla_updates(missing))
+
+    return cache
+
+
+def fetch_sla_updates(ticket_names):
+    """
+    Returns {ticket_id: Sla Update row} for the given tickets.
+    """
+    rows = frappe.get_all(
         "Sla Update",
-        filters={"ticket_id": ticket_name},
-        pluck="name"
+        filters={"ticket_id": ["in", ticket_names]},
+        fields=SLA_UPDATE_FIELDS
     )
+    return {row.ticket_id: row for row in rows}
+
+
+def upsert_sla_updates(ticket_names, now):
+    """
+    Create blank Sla Update rows with one INSERT ... ON DUPLICATE KEY UPDATE.
+
+    The update clause is a no-op: a conflict on the unique `ticket_id`
+    (row created concurrently) or on the primary key (generated name already
+    taken) leaves the existing row untouched and inserts nothing.
+    """
+    user = frappe.session.user
+    values = []
+
+    for ticket_name in ticket_names:
+        values.extend((
+            frappe.generate_hash(length=10), ticket_name,
+            now, now, user, user
+        ))
+
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(ticket_names))
+
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tabSla Update`
+            (name, ticket_id, creation, modified, owner, modified_by)
+        VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE name = name
+        """,
+        values
+    )
+
+
+def stage_sla_update(sla_update, values, dirty):
+    """
+    Apply changes to a Sla Update row and stage them for the end-of-chunk flush.
+    """
+    sla_update.update(values)
+    dirty.setdefault(sla_update.name, {}).update(values)
 
-    if existing:
-        return frappe.get_doc("Sla Update", existing[0])
 
-    doc = frappe.get_doc({
-        "doctype": "Sla Update",
-        "ticket_id": ticket_name
-    })
-    doc.insert(ignore_permissions=True)
-    frappe.db.commit()
-    return doc
+def flush_sla_updates(dirty):
+    """
+    Write all staged Sla Update changes (committed by the caller).
+
+    Each dirty row gets a single multi-field UPDATE; Document hooks and the
+    modified stamp are skipped since these are engine bookkeeping fields.
+    """
+    for name, values in dirty.items():
+        frappe.db.set_value(
+            "Sla Update", name, values, update_modified=False
+        )
+
+
+def flush_notified_flags(pending_flags):
+    """
+    Set all pending milestone flags with a single UPDATE ... CASE statement.
+
+    `pending_flags` maps Sla Update name -> set of notified fieldnames.
+    """
+    if not pending_flags:
+        return
+
+    assignments = []
+    values = {"names": tuple(pending_flags)}
+
+    for field in NOTIFIED_FIELDS:
+        names = tuple(
+            name for name, fields in pending_flags.items() if field in fields
+        )
+        if not names:
+            continue
+
+        assignments.append(
+            f"`{field}` = CASE WHEN name IN %({field})s THEN 1 ELSE `{field}` END"
+        )
+        values[field] = names
+
+    frappe.db.sql(
+        f"""
+        UPDATE `tabSla Update`
+        SET {", ".join(assignments)}
+        WHERE name IN %(names)s
+        """,
+        values
+    )
 
 
 # =========================================================
 # STATE-BASED TIMESTAMP RECORDING
 # =========================================================
 
-def record_first_response_time(ticket, sla_update):
+def record_first_response_time(ticket, sla_update, dirty, now):
     """
     Record First Responded On when ticket enters In-Progress.
     """
@@ -96,12 +325,12 @@ def record_first_response_time(ticket, sla_update):
         ticket.status == "In-Progress"
         and not sla_update.first_responded_on
     ):
-        sla_update.first_responded_on = now_datetime()
-        sla_update.save(ignore_permissions=True)
-        frappe.db.commit()
+        stage_sla_update(
+            sla_update, {"first_responded_on": now}, dirty
+        )
 
 
-def record_resolution_time(ticket, sla_update):
+def record_resolution_time(ticket, sla_update, dirty):
     """
     Copy Resolution Date from HD Ticket once it appears.
     """
@@ -109,157 +338,179 @@ def record_resolution_time(ticket, sla_update):
         ticket.resolution_date
         and not sla_update.resolution_date
     ):
-        sla_update.resolution_date = get_datetime(ticket.resolution_date)
-        sla_update.save(ignore_permissions=True)
-        frappe.db.commit()
+        # Datetime columns already come back as datetime objects
+        stage_sla_update(
+            sla_update, {"resolution_date": ticket.resolution_date}, dirty
+        )
 
 
 # =========================================================
 # ASSIGNEE EMAIL FETCH
 # =========================================================
 
-def get_ticket_assignee_email(ticket_name):
+def preload_assignee_emails(ticket_names):
     """
-    Returns email address of the first open ToDo assignee.
-    """
-    assignees = frappe.get_all(
-        "ToDo",
-        filters={
-            "reference_type": "HD Ticket",
-            "reference_name": ticket_name,
-            "status": "Open"
-        },
-        pluck="allocated_to",
-        limit=1
-    )
+    Returns {ticket name (str): email} of the first open ToDo assignee for
+    each ticket, fetched with a single ToDo/User join.
 
-    if not assignees:
-        return None
-
-    return frappe.get_value("User", assignees[0], "email")
+    "First" follows ToDo's default list ordering (its sort_field/sort_order),
+    matching what frappe.get_all(..., limit=1) returned per ticket.
+    """
+    if not ticket_names:
+        return {}
+
+    meta = frappe.get_meta("ToDo")
+    sort_field = meta.sort_field or "creation"
+    sort_order = "ASC" if (meta.sort_order or "").upper() == "ASC" else "DESC"
+
+    return dict(frappe.db.sql(
+        f"""
+        SELECT first_todo.reference_name, u.email
+        FROM (
+            SELECT
+                reference_name, allocated_to,
+                ROW_NUMBER() OVER (
+                    PARTITION BY reference_name
+                    ORDER BY `{sort_field}` {sort_order}, name {sort_order}
+                ) AS position
+            FROM `tabToDo`
+            WHERE reference_type = 'HD Ticket'
+                AND status = 'Open'
+                AND reference_name IN %(names)s
+        ) first_todo
+        JOIN `tabUser` u ON u.name = first_todo.allocated_to
+        WHERE first_todo.position = 1
+        """,
+        {"names": tuple(ticket_names)}
+    ))
 
 
 # =========================================================
 # COMMON SLA UTILITIES
 # =========================================================
 
-def get_percentage(start, due):
+def get_last_notified(sla_update, fields):
     """
-    Calculates elapsed SLA percentage.
+    Returns the highest milestone already notified (fields: FR_ / RES_FIELDS).
     """
-    if not start or not due:
-        return 0
-
-    start = get_datetime(start)
-    due = get_datetime(due)
-
-    total = (due - start).total_seconds()
-    if total <= 0:
-        return 100
-
-    elapsed = (now_datetime() - start).total_seconds()
-    return min((elapsed / total) * 100, 100)
+    for milestone in reversed(MILESTONES):
+        if sla_update.get(fields[milestone]):
+            return milestone
+    return 0
 
 
 # =========================================================
 # FIRST RESPONSE SLA HANDLER
 # =========================================================
 
-def handle_first_response(ticket, sla_update):
+def handle_first_response(ticket, sla_update, pending_flags, assignee_emails):
     """
     Handles 50%, 75%, 100% milestones for First Response SLA.
     """
     if ticket.first_response_time:
         return
 
-    pct = get_percentage(ticket.creation, ticket.response_by)
-
-    for milestone in (50, 75, 100):
-        if pct < milestone:
-            continue
+    last = get_last_notified(sla_update, FR_FIELDS)
+    if last == 100:
+        return
 
-        field = f"fr_{milestone}_notified"
-        if getattr(sla_update, field, 0):
+    for milestone in MILESTONES:
+        if milestone <= last or ticket.fr_pct < milestone:
             continue
 
-        send_email(ticket, "first response", milestone)
-        setattr(sla_update, field, 1)
-
-    sla_update.save(ignore_permissions=True)
-    frappe.db.commit()
+        field = FR_FIELDS[milestone]
+        send_email(
+            ticket, "first response", milestone,
+            assignee_emails.get(cstr(ticket.name))
+        )
+        sla_update[field] = 1
+        pending_flags.setdefault(sla_update.name, set()).add(field)
 
 
 # =========================================================
 # RESOLUTION SLA HANDLER
 # =========================================================
 
-def handle_resolution(ticket, sla_update):
+def handle_resolution(ticket, sla_update, pending_flags, assignee_emails):
     """
     Handles 50%, 75%, 100% milestones for Resolution SLA.
     """
     if ticket.resolution_time:
         return
 
-    pct = get_percentage(ticket.creation, ticket.resolution_by)
-
-    for milestone in (50, 75, 100):
-        if pct < milestone:
-            continue
+    last = get_last_notified(sla_update, RES_FIELDS)
+    if last == 100:
+        return
 
-        field = f"res_{milestone}_notified"
-        if getattr(sla_update, field, 0):
+    for milestone in MILESTONES:
+        if milestone <= last or ticket.res_pct < milestone:
             continue
 
-        send_email(ticket, "resolution", milestone)
-        setattr(sla_update, field, 1)
-
-    sla_update.save(ignore_permissions=True)
-    frappe.db.commit()
+        field = RES_FIELDS[milestone]
+        send_email(
+            ticket, "resolution", milestone,
+            assignee_emails.get(cstr(ticket.name))
+        )
+        sla_update[field] = 1
+        pending_flags.setdefault(sla_update.name, set()).add(field)
 
-def close_resolved_tickets():
-    resolved = frappe.get_all("HD Ticket",filters={"status":"Resolved"},pluck = "name")
-    for name in resolved:
-        doc = frappe.get_doc("HD Ticket",name)
-        if add_days(doc.resolution_date,2) < now_datetime():
-            doc.status = "Closed"
-            doc.save()
-    frappe.db.commit() 
+def close_resolved_tickets(now):
+    """
+    Close tickets that have stayed Resolved for more than two days.
+    """
+    stale = frappe.get_all(
+        "HD Ticket",
+        filters={
+            "status": "Resolved",
+            "resolution_date": ["<", now - timedelta(days=2)]
+        },
+        pluck="name"
+    )
+    # Only stale tickets are loaded; save() keeps HD Ticket hooks running
+    for name in stale:
+        doc = frappe.get_doc("HD Ticket", name)
+        doc.status = "Closed"
+        doc.save()
 
 
 # =========================================================
 # EMAIL SENDER
 # =========================================================
 
-def send_email(ticket, sla_type, milestone):
+SLA_LABELS = {
+    "first response": "First Response SLA",
+    "resolution": "Resolution SLA",
+}
+
+SUBJECT_TEMPLATE = "{label} Alert ({milestone}%) – Ticket {ticket}"
+MESSAGE_TEMPLATE = "{milestone}% of {sla_type} time has passed for ticket {ticket}."
+BREACH_MESSAGE_TEMPLATE = (
+    "All {sla_type} time for ticket {ticket} has passed.<br><br>"
+    "Immediate action is required."
+)
+
+
+def send_email(ticket, sla_type, milestone, assignee_email):
     """
     Sends SLA notification email to assignee.
     """
-    assignee_email = get_ticket_assignee_email(ticket.name)
     if not assignee_email:
         return
 
-    sla_label = (
-        "First Response SLA"
-        if sla_type == "first response"
-        else "Resolution SLA"
+    subject = SUBJECT_TEMPLATE.format(
+        label=SLA_LABELS[sla_type], milestone=milestone, ticket=ticket.name
     )
 
-    subject = f"{sla_label} Alert ({milestone}%) – Ticket {ticket.name}"
-
-    if milestone == 100:
-        message = (
-            f"All {sla_type} time for ticket {ticket.name} has passed.<br><br>"
-            "Immediate action is required."
-        )
-    else:
-        message = (
-            f"{milestone}% of {sla_type} time has passed for "
-            f"ticket {ticket.name}."
-        )
+    template = (
+        BREACH_MESSAGE_TEMPLATE if milestone == 100 else MESSAGE_TEMPLATE
+    )
+    message = template.format(
+        milestone=milestone, sla_type=sla_type, ticket=ticket.name
+    )
 
     frappe.sendmail(
         recipients=[assignee_email],
         subject=subject,
         message=message,
-        delayed=False
+        delayed=True
     )
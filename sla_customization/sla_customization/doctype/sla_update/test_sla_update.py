@@ -1,9 +1,15 @@
 # Copyright (c) 2026, Jay Anjarlekar and Contributors
 # See license.txt
 
-# import frappe
+from datetime import timedelta
+from unittest.mock import patch
+
+import frappe
 from frappe.tests import IntegrationTestCase
+from frappe.utils import cstr, get_datetime, now_datetime
 
+from sla_customization.patches.v1_0.remove_duplicate_sla_updates import remove_duplicates
+from sla_customization.services import sla_engine
 
 # On IntegrationTestCase, the doctype test records and all
 # link-field test record dependencies are recursively loaded
@@ -12,6 +18,43 @@ EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 
 
+def make_ticket(**values):
+	"""
+	Insert an HD Ticket and overwrite the given columns directly, so SLA dates
+	and statuses are not recomputed by Helpdesk.
+	"""
+	ticket = frappe.get_doc(
+		{
+			"doctype": "HD Ticket",
+			"subject": "SLA engine test",
+			"description": "SLA engine test",
+			"raised_by": "sla-engine-test@example.com",
+		}
+	).insert(ignore_permissions=True)
+
+	if values:
+		frappe.db.set_value("HD Ticket", ticket.name, values, update_modified=False)
+
+	return ticket.name
+
+
+def make_sla_update(ticket, **values):
+	return (
+		frappe.get_doc({"doctype": "Sla Update", "ticket_id": cstr(ticket), **values})
+		.insert(ignore_permissions=True)
+		.name
+	)
+
+
+def get_ticket_rows(now, chunk_size=sla_engine.CHUNK_SIZE):
+	return {
+		cstr(row.name): row for chunk in sla_engine.iter_ticket_chunks(now, chunk_size) for row in chunk
+	}
+
+
+def get_flags(sla_update):
+	return frappe.db.get_value("Sla Update", sla_update, sla_engine.NOTIFIED_FIELDS, as_dict=True)
+
 
 class IntegrationTestSlaUpdate(IntegrationTestCase):
 	"""
@@ -19,4 +62,231 @@ class IntegrationTestSlaUpdate(IntegrationTestCase):
 	Use this class for testing interactions between multiple components.
 	"""
 
-	pass
+	def test_elapsed_percentage_boundaries(self):
+		now = now_datetime()
+		creation = now - timedelta(seconds=200)
+
+		no_due_date = make_ticket(status="Open", creation=creation, response_by=None, resolution_by=None)
+		due_at_creation = make_ticket(
+			status="Open", creation=creation, response_by=creation, resolution_by=creation
+		)
+		due_before_creation = make_ticket(
+			status="Open",
+			creation=creation,
+			response_by=creation - timedelta(hours=1),
+			resolution_by=creation - timedelta(hours=1),
+		)
+		overdue = make_ticket(
+			status="Open",
+			creation=creation,
+			response_by=creation + timedelta(seconds=100),
+			resolution_by=creation + timedelta(seconds=150),
+		)
+
+		rows = get_ticket_rows(now)
+
+		self.assertEqual(float(rows[cstr(no_due_date)].fr_pct), 0)
+		self.assertEqual(float(rows[cstr(no_due_date)].res_pct), 0)
+		self.assertEqual(float(rows[cstr(due_at_creation)].fr_pct), 100)
+		self.assertEqual(float(rows[cstr(due_before_creation)].res_pct), 100)
+		# capped at 100 once the due date has passed
+		self.assertEqual(float(rows[cstr(overdue)].fr_pct), 100)
+		self.assertEqual(float(rows[cstr(overdue)].res_pct), 100)
+
+	def test_elapsed_percentage_counts_whole_seconds(self):
+		now = now_datetime()
+		creation = now - timedelta(seconds=10, microseconds=900000)
+
+		ticket = make_ticket(
+			status="Open",
+			creation=creation,
+			response_by=creation + timedelta(seconds=100),
+			resolution_by=creation + timedelta(seconds=30),
+		)
+
+		row = get_ticket_rows(now)[cstr(ticket)]
+
+		# TIMESTAMPDIFF truncates 10.9s elapsed to 10s
+		self.assertEqual(float(row.fr_pct), 10)
+		self.assertAlmostEqual(float(row.res_pct), 33.3333, places=4)
+
+	def test_flush_notified_flags_only_sets_pending_flags(self):
+		first = make_sla_update(make_ticket(), res_75_notified=1)
+		second = make_sla_update(make_ticket())
+		untouched = make_sla_update(make_ticket(), fr_75_notified=1)
+		blank = dict.fromkeys(sla_engine.NOTIFIED_FIELDS, 0)
+
+		sla_engine.flush_notified_flags(
+			{
+				first: {"fr_50_notified"},
+				second: {"fr_100_notified", "res_100_notified"},
+			}
+		)
+
+		self.assertEqual(get_flags(first), {**blank, "fr_50_notified": 1, "res_75_notified": 1})
+		self.assertEqual(get_flags(second), {**blank, "fr_100_notified": 1, "res_100_notified": 1})
+		self.assertEqual(get_flags(untouched), {**blank, "fr_75_notified": 1})
+
+	def test_second_pass_sends_no_new_emails(self):
+		now = now_datetime()
+		ticket = make_ticket(
+			status="Open",
+			creation=now - timedelta(hours=2),
+			response_by=now - timedelta(hours=1),
+			resolution_by=now - timedelta(hours=1),
+			first_response_time=None,
+			resolution_time=None,
+		)
+		frappe.get_doc(
+			{
+				"doctype": "ToDo",
+				"allocated_to": "Administrator",
+				"reference_type": "HD Ticket",
+				"reference_name": cstr(ticket),
+				"status": "Open",
+				"description": "SLA engine test",
+			}
+		).insert(ignore_permissions=True)
+		admin_email = frappe.db.get_value("User", "Administrator", "email")
+
+		# process_ticket_batch flushes without committing, so the test
+		# transaction stays intact and other tickets on the site are not touched
+		with patch("frappe.sendmail") as sendmail:
+			sla_engine.process_ticket_batch([get_ticket_rows(now)[cstr(ticket)]], now)
+			first_pass = [call.kwargs for call in sendmail.call_args_list]
+
+			sla_engine.process_ticket_batch([get_ticket_rows(now)[cstr(ticket)]], now)
+			both_passes = [call.kwargs for call in sendmail.call_args_list]
+
+		# 50/75/100% for both First Response and Resolution SLA
+		self.assertEqual(len(first_pass), 6)
+		self.assertTrue(all(mail["recipients"] == [admin_email] for mail in first_pass))
+		self.assertEqual(len(both_passes), len(first_pass))
+
+	def test_upsert_never_rewrites_existing_rows(self):
+		ticket = cstr(make_ticket())
+		other = cstr(make_ticket())
+		existing = make_sla_update(ticket)
+
+		sla_engine.upsert_sla_updates([ticket], now_datetime())
+		self.assertEqual(frappe.get_all("Sla Update", filters={"ticket_id": ticket}, pluck="name"), [existing])
+
+		# generated name collides with another ticket's row
+		with patch("frappe.generate_hash", return_value=existing):
+			sla_engine.upsert_sla_updates([other], now_datetime())
+
+		self.assertEqual(frappe.db.get_value("Sla Update", existing, "ticket_id"), ticket)
+		self.assertFalse(frappe.db.exists("Sla Update", {"ticket_id": other}))
+
+	def test_done_tickets_with_complete_sla_update_are_skipped(self):
+		now = now_datetime()
+
+		complete = make_ticket(status="Closed", resolution_date=now)
+		make_sla_update(complete, resolution_date=now)
+		no_sla_update = make_ticket(status="Resolved", resolution_date=now)
+		date_not_copied = make_ticket(status="Resolved", resolution_date=now)
+		make_sla_update(date_not_copied)
+
+		rows = get_ticket_rows(now)
+
+		self.assertNotIn(cstr(complete), rows)
+		self.assertIn(cstr(no_sla_update), rows)
+		self.assertIn(cstr(date_not_copied), rows)
+
+	def test_resolved_tickets_close_after_two_days(self):
+		now = now_datetime()
+		two_days_ago = now - timedelta(days=2)
+
+		just_under = make_ticket(status="Resolved", resolution_date=two_days_ago + timedelta(minutes=1))
+		just_over = make_ticket(status="Resolved", resolution_date=two_days_ago - timedelta(minutes=1))
+
+		sla_engine.close_resolved_tickets(now)
+
+		self.assertEqual(frappe.db.get_value("HD Ticket", just_under, "status"), "Resolved")
+		self.assertEqual(frappe.db.get_value("HD Ticket", just_over, "status"), "Closed")
+
+	def test_chunks_neither_skip_nor_repeat_tickets(self):
+		tickets = {cstr(make_ticket(status="Open")) for _ in range(5)}
+
+		chunks = list(sla_engine.iter_ticket_chunks(now_datetime(), chunk_size=2))
+		seen = [cstr(row.name) for chunk in chunks for row in chunk]
+
+		self.assertTrue(all(len(chunk) <= 2 for chunk in chunks))
+		self.assertEqual(len(seen), len(set(seen)))
+		self.assertTrue(tickets <= set(seen))
+
+
+DEDUPE_TABLE = "tmp_sla_update_dedupe"
+
+
+class IntegrationTestRemoveDuplicateSlaUpdates(IntegrationTestCase):
+	"""
+	Tests the remove_duplicate_sla_updates patch on a temporary copy of
+	`tabSla Update` without the unique index on ticket_id, so duplicates can be
+	seeded without DDL that would commit the test transaction.
+	"""
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		frappe.db.sql(f"CREATE TEMPORARY TABLE `{DEDUPE_TABLE}` AS SELECT * FROM `tabSla Update` WHERE 0")
+
+	@classmethod
+	def tearDownClass(cls):
+		super().tearDownClass()
+		frappe.db.sql(f"DROP TEMPORARY TABLE IF EXISTS `{DEDUPE_TABLE}`")
+
+	def insert_row(self, name, ticket_id, creation, **values):
+		values = {"name": name, "ticket_id": ticket_id, "creation": creation, "modified": creation, **values}
+		columns = ", ".join(f"`{column}`" for column in values)
+		placeholders = ", ".join(["%s"] * len(values))
+		frappe.db.sql(
+			f"INSERT INTO `{DEDUPE_TABLE}` ({columns}) VALUES ({placeholders})",
+			tuple(values.values()),
+		)
+
+	def get_row(self, name):
+		return frappe.db.sql(f"SELECT * FROM `{DEDUPE_TABLE}` WHERE name = %s", name, as_dict=True)[0]
+
+	def test_newest_duplicate_survives_with_merged_progress(self):
+		older = get_datetime("2026-01-01 10:00:00")
+		newer = get_datetime("2026-01-02 10:00:00")
+		first_responded_on = get_datetime("2026-01-01 11:00:00")
+		old_resolution = get_datetime("2026-01-03 10:00:00")
+		new_resolution = get_datetime("2026-01-04 10:00:00")
+
+		self.insert_row(
+			"dedupe-a",
+			"DEDUPE-1",
+			older,
+			fr_50_notified=1,
+			first_responded_on=first_responded_on,
+			resolution_date=old_resolution,
+		)
+		self.insert_row("dedupe-b", "DEDUPE-1", newer, res_75_notified=1)
+		# same creation as dedupe-b; the higher name wins the tie
+		self.insert_row("dedupe-c", "DEDUPE-1", newer, fr_100_notified=1, resolution_date=new_resolution)
+		self.insert_row("dedupe-single", "DEDUPE-2", older, res_50_notified=1)
+		self.insert_row("dedupe-null-1", None, older)
+		self.insert_row("dedupe-null-2", None, older)
+
+		remove_duplicates(DEDUPE_TABLE)
+
+		remaining = frappe.db.sql_list(f"SELECT name FROM `{DEDUPE_TABLE}` ORDER BY name")
+		self.assertEqual(remaining, ["dedupe-c", "dedupe-null-1", "dedupe-null-2", "dedupe-single"])
+
+		survivor = self.get_row("dedupe-c")
+		self.assertEqual(
+			{field: survivor[field] for field in sla_engine.NOTIFIED_FIELDS},
+			{
+				**dict.fromkeys(sla_engine.NOTIFIED_FIELDS, 0),
+				"fr_50_notified": 1,
+				"res_75_notified": 1,
+				"fr_100_notified": 1,
+			},
+		)
+		# its own timestamp is kept; a missing one is filled from a duplicate
+		self.assertEqual(survivor.resolution_date, new_resolution)
+		self.assertEqual(survivor.first_responded_on, first_responded_on)
+
+		self.assertEqual(self.get_row("dedupe-single").res_50_notified, 1)